@@ -31,7 +31,11 @@ curl -i -X POST -H "Accept:application/json" -H "Content-Type:application/json"
     "key.converter": "org.apache.kafka.connect.json.JsonConverter",
     "value.converter": "org.apache.kafka.connect.json.JsonConverter",
     "key.converter.schemas.enable": "false",
-    "value.converter.schemas.enable": "false"
+    "value.converter.schemas.enable": "false",
+    "transforms": "filter",
+    "transforms.filter.type": "io.debezium.transforms.Filter",
+    "transforms.filter.language": "jsr223.groovy",
+    "transforms.filter.condition": "value.op in [\"c\", \"r\", \"u\", \"d\"]"
   }
 }'
 
@@ -1,69 +1,133 @@
+import hashlib
+import logging
 import time
 import os
+import random
 import requests
+from requests.adapters import HTTPAdapter
+import signal
 import json
 import sys
 
-# Force unbuffered output to see logs in Docker
-os.environ['PYTHONUNBUFFERED'] = '1'
-sys.stdout.flush()
-sys.stderr.flush()
+# Configure logging once; records are line-buffered to stdout for Docker logs
+sys.stdout.reconfigure(line_buffering=True)
+logging.basicConfig(
+    level=logging.INFO,
+    format='[%(asctime)s] %(message)s',
+    datefmt='%Y-%m-%d %H:%M:%S',
+    stream=sys.stdout
+)
+log = logging.getLogger(__name__)
 
 FLINK_JOBMANAGER_HOST = os.getenv('FLINK_JOBMANAGER_HOST', 'flink-jobmanager')
+FLINK_EXPECTED_TASKMANAGERS = int(os.getenv('FLINK_EXPECTED_TASKMANAGERS', '1'))
 KAFKA_BOOTSTRAP_SERVERS = os.getenv('KAFKA_BOOTSTRAP_SERVERS', 'kafka:29092')
 POSTGRES_HOST = os.getenv('POSTGRES_HOST', 'postgres-dest')
 POSTGRES_PORT = os.getenv('POSTGRES_PORT', '5432')
 POSTGRES_USER = os.getenv('POSTGRES_USER', 'destuser')
 POSTGRES_PASSWORD = os.getenv('POSTGRES_PASSWORD', 'destpass')
 POSTGRES_DB = os.getenv('POSTGRES_DB', 'destdb')
+FLINK_SQL_GATEWAY_HOST = os.getenv('FLINK_SQL_GATEWAY_HOST', 'flink-sql-gateway')
+FLINK_SQL_GATEWAY_PORT = os.getenv('FLINK_SQL_GATEWAY_PORT', '8083')
+SQL_GATEWAY_URL = f"http://{FLINK_SQL_GATEWAY_HOST}:{FLINK_SQL_GATEWAY_PORT}"
+# Submitted as '<FLINK_JOB_NAME>-<sql hash>' so restarts can tell which SQL a job runs
+FLINK_JOB_NAME = os.getenv('FLINK_JOB_NAME', 'orders-flink-sync')
+INSTRUCTIONS_FILE = '/tmp/flink_setup_instructions.sql'
 
-print("=" * 60)
-print("STARTING FLINK SQL CLIENT INITIALIZATION")
-print("=" * 60)
-print(f"FLINK_JOBMANAGER_HOST: {FLINK_JOBMANAGER_HOST}")
-print(f"KAFKA_BOOTSTRAP_SERVERS: {KAFKA_BOOTSTRAP_SERVERS}")
-print(f"POSTGRES_HOST: {POSTGRES_HOST}")
-print("=" * 60)
-sys.stdout.flush()
+# (connect, read) timeouts: readiness probes fail fast, gateway calls get longer
+PROBE_TIMEOUT = (2, 5)
+GATEWAY_TIMEOUT = (2, 30)
 
-def wait_for_services():
-    """Wait for all services to be ready"""
-    print("Waiting for services to be ready...")
-    sys.stdout.flush()
-    time.sleep(30)
-    
-    # Wait for Flink JobManager
-    max_retries = 30
+TERMINAL_JOB_STATES = ('CANCELED', 'FAILED', 'FINISHED')
+
+log.info("=" * 60)
+log.info("STARTING FLINK SQL CLIENT INITIALIZATION")
+log.info("=" * 60)
+log.info("FLINK_JOBMANAGER_HOST: %s", FLINK_JOBMANAGER_HOST)
+log.info("FLINK_SQL_GATEWAY: %s", SQL_GATEWAY_URL)
+log.info("KAFKA_BOOTSTRAP_SERVERS: %s", KAFKA_BOOTSTRAP_SERVERS)
+log.info("POSTGRES_HOST: %s", POSTGRES_HOST)
+log.info("=" * 60)
+
+def backoff(attempt, base=0.5, cap=30):
+    """Capped exponential backoff with jitter, in seconds"""
+    return min(cap, base * 2 ** attempt) * (0.5 + random.random())
+
+def create_http_session():
+    """Keep-alive HTTP session shared by the readiness probes and SQL Gateway calls"""
+    http = requests.Session()
+    # Retries are driven by our own backoff loops, not urllib3
+    http.mount('http://', HTTPAdapter(pool_connections=2, pool_maxsize=1, max_retries=0))
+    return http
+
+http_session = create_http_session()
+
+def wait_for_endpoint(name, url, ready=None, max_retries=30):
+    """Poll an HTTP endpoint until it answers with 200 (and `ready(response)` holds)"""
     retry_count = 0
     
     while retry_count < max_retries:
         try:
-            response = requests.get(f'http://{FLINK_JOBMANAGER_HOST}:8081/overview')
-            if response.status_code == 200:
-                print("Flink JobManager is ready")
-                sys.stdout.flush()
-                break
+            response = http_session.get(url, timeout=PROBE_TIMEOUT)
+            if response.status_code == 200 and (ready is None or ready(response)):
+                log.info("%s is ready", name)
+                return True
         except Exception as e:
-            print(f"  Error connecting to Flink: {type(e).__name__}: {str(e)}")
-            sys.stdout.flush()
+            log.info("  Error connecting to %s: %s: %s", name, type(e).__name__, e)
         
         retry_count += 1
-        print(f"Waiting for Flink JobManager (attempt {retry_count}/{max_retries})...")
-        sys.stdout.flush()
-        time.sleep(5)
+        log.info("Waiting for %s (attempt %s/%s)...", name, retry_count, max_retries)
+        time.sleep(backoff(retry_count))
     
-    if retry_count >= max_retries:
-        print("WARNING: Flink JobManager did not respond after max retries")
-        sys.stdout.flush()
+    log.warning("WARNING: %s did not respond after max retries", name)
+    return False
+
+def wait_for_services():
+    """Wait for all services to be ready"""
+    log.info("Waiting for services to be ready...")
     
-    time.sleep(10)
+    # The JobManager can only run the job once TaskManagers have registered
+    wait_for_endpoint(
+        "Flink JobManager",
+        f'http://{FLINK_JOBMANAGER_HOST}:8081/taskmanagers',
+        ready=lambda response: (
+            len(response.json().get('taskmanagers', [])) >= FLINK_EXPECTED_TASKMANAGERS
+        )
+    )
+    wait_for_endpoint("Flink SQL Gateway", f'{SQL_GATEWAY_URL}/v1/info')
 
-def submit_flink_sql_job():
-    """Submit Flink SQL job using SQL Gateway (Table API)"""
+def execute_statement(session_handle, statement, timeout=300):
+    """Run a single statement through the SQL Gateway and wait for its result"""
+    session_url = f"{SQL_GATEWAY_URL}/v1/sessions/{session_handle}"
+    response = http_session.post(
+        f"{session_url}/statements", json={'statement': statement}, timeout=GATEWAY_TIMEOUT
+    )
+    response.raise_for_status()
+    operation_url = f"{session_url}/operations/{response.json()['operationHandle']}"
+    
+    # Poll with exponential backoff instead of a fixed busy-wait
+    attempt = 0
+    deadline = time.time() + timeout
+    while True:
+        status = http_session.get(f"{operation_url}/status", timeout=GATEWAY_TIMEOUT).json()['status']
+        if status == 'FINISHED':
+            break
+        if status in ('ERROR', 'CANCELED', 'CLOSED', 'TIMEOUT'):
+            result = http_session.get(f"{operation_url}/result/0", timeout=GATEWAY_TIMEOUT)
+            raise Exception(f"Statement {status}: {result.text}")
+        if time.time() > deadline:
+            raise Exception(f"Statement still {status} after {timeout}s")
+        time.sleep(backoff(attempt, base=0.1, cap=5))
+        attempt += 1
     
-    # Flink SQL statements to create tables and run the job
-    sql_statements = f"""
--- Create source table reading from Kafka
+    response = http_session.get(f"{operation_url}/result/0", timeout=GATEWAY_TIMEOUT)
+    response.raise_for_status()
+    return response.json()
+
+def build_sql_statements():
+    """Render the job name and Flink SQL statements for the job from the environment"""
+    
+    create_source = f"""
 CREATE TABLE IF NOT EXISTS kafka_orders (
     `before` ROW<order_id INT, user_id INT, name STRING>,
     `after` ROW<order_id INT, user_id INT, name STRING>,
@@ -78,9 +142,9 @@ CREATE TABLE IF NOT EXISTS kafka_orders (
     'format' = 'json',
     'json.fail-on-missing-field' = 'false',
     'json.ignore-parse-errors' = 'true'
-);
+)"""
 
--- Create sink table for orders_flink (without name column)
+    create_sink = f"""
 CREATE TABLE IF NOT EXISTS orders_flink_sink (
     order_id INT,
     user_id INT,
@@ -96,182 +160,200 @@ CREATE TABLE IF NOT EXISTS orders_flink_sink (
     'sink.max-retries' = '3',
     'sink.buffer-flush.max-rows' = '100',
     'sink.buffer-flush.interval' = '1000'
-);
+)"""
 
--- Insert data from Kafka to orders_flink, dropping the name column
+    # INSERTs go into one statement set so they are compiled into a single job
+    insert_job = """
+EXECUTE STATEMENT SET
+BEGIN
 INSERT INTO orders_flink_sink
 SELECT 
     COALESCE(`after`.order_id, `before`.order_id) as order_id,
     COALESCE(`after`.user_id, `before`.user_id) as user_id
 FROM kafka_orders
 WHERE `op` IN ('c', 'r', 'u');
-"""
-    
-    # Write SQL to file for execution
-    sql_file = '/tmp/flink_job.sql'
-    with open(sql_file, 'w') as f:
-        f.write(sql_statements)
+END"""
+
+    # The gateway executes one statement per request; DDLs only touch the
+    # session catalog, the statement set is what builds the JobGraph
+    statements = [create_source, create_sink, insert_job]
     
-    print("\nFlink SQL job file created at:", sql_file)
-    print("=" * 60)
-    print("SQL STATEMENTS:")
-    print("=" * 60)
-    print(sql_statements)
-    print("=" * 60)
-    sys.stdout.flush()
+    # The job name carries the SQL hash, so the cluster itself records which
+    # SQL a running job was built from
+    job_name = f"{FLINK_JOB_NAME}-{sql_hash(statements)[:8]}"
+    return job_name, [f"SET 'pipeline.name' = '{job_name}'"] + statements
+
+def render_sql(statements):
+    """Join statements into a script runnable by the SQL client"""
+    return ";\n".join(statements) + ";\n"
+
+def sql_hash(statements):
+    """Stable fingerprint of the rendered SQL"""
+    return hashlib.blake2b(render_sql(statements).encode(), digest_size=16).hexdigest()
+
+def write_atomic(path, content):
+    """Write a file via a temp file + rename so readers never see a partial write"""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w') as f:
+        f.write(content)
+    os.replace(tmp_path, path)
+
+def active_flink_jobs():
+    """(id, name) of every job under FLINK_JOB_NAME that has not terminated, or None if unknown"""
+    try:
+        response = http_session.get(
+            f'http://{FLINK_JOBMANAGER_HOST}:8081/jobs/overview', timeout=PROBE_TIMEOUT
+        )
+        response.raise_for_status()
+        jobs = response.json().get('jobs', [])
+    except Exception as e:
+        log.warning("Could not list Flink jobs: %s", e)
+        return None
+    # INITIALIZING, CREATED, RESTARTING etc. will all end up writing to the sink
+    return [
+        (job['jid'], job['name']) for job in jobs
+        if job.get('state') not in TERMINAL_JOB_STATES
+        and (job.get('name') == FLINK_JOB_NAME or job.get('name', '').startswith(f"{FLINK_JOB_NAME}-"))
+    ]
+
+def cancel_flink_job(job_id):
+    """Cancel a job and wait until it has left the RUNNING state"""
+    log.info("Cancelling Flink job %s", job_id)
+    response = http_session.patch(
+        f'http://{FLINK_JOBMANAGER_HOST}:8081/jobs/{job_id}',
+        params={'mode': 'cancel'},
+        timeout=PROBE_TIMEOUT
+    )
+    response.raise_for_status()
+    return wait_for_endpoint(
+        f"cancellation of job {job_id}",
+        f'http://{FLINK_JOBMANAGER_HOST}:8081/jobs/{job_id}',
+        ready=lambda response: response.json().get('state') in TERMINAL_JOB_STATES
+    )
+
+def submit_flink_sql_job(statements):
+    """Submit Flink SQL job using SQL Gateway (Table API)"""
     
-    # Execute using Flink SQL client
-    import subprocess
+    log.info("=" * 60)
+    log.info("SQL STATEMENTS:")
+    log.info("=" * 60)
+    log.info("%s", render_sql(statements))
+    log.info("=" * 60)
     
+    session_handle = None
     try:
-        # Note: In production, you would use the Flink SQL Gateway or submit via REST API
-        # For this setup, we'll use the sql-client in embedded mode with remote execution
-        print(f"\nAttempting to run: /opt/flink/bin/sql-client.sh embedded -f {sql_file}")
-        print("Using execution.target=remote to connect to cluster...")
-        sys.stdout.flush()
-        
-        result = subprocess.run([
-            '/opt/flink/bin/sql-client.sh',
-            'embedded',
-            '-D', 'execution.target=remote',
-            '-D', f'rest.address=flink-jobmanager',
-            '-D', f'rest.port=8081',
-            '-f',
-            sql_file
-        ], capture_output=True, text=True, timeout=300)
+        log.info("Opening SQL Gateway session at %s", SQL_GATEWAY_URL)
+        response = http_session.post(f"{SQL_GATEWAY_URL}/v1/sessions", json={}, timeout=GATEWAY_TIMEOUT)
+        response.raise_for_status()
+        session_handle = response.json()['sessionHandle']
         
-        print("\n" + "=" * 60)
-        print("FLINK SQL CLIENT OUTPUT:")
-        print("=" * 60)
-        print("STDOUT:")
-        print(result.stdout)
-        print("\nSTDERR:")
-        print(result.stderr)
-        print(f"\nReturn code: {result.returncode}")
-        print("=" * 60)
-        sys.stdout.flush()
+        for statement in statements:
+            result = execute_statement(session_handle, statement)
         
-        # Check for errors in output
-        if "ERROR" in result.stdout or "ERROR" in result.stderr:
-            print("\n⚠️  ERRORS DETECTED IN EXECUTION")
-            print("\nDiagnostic Information:")
-            print(f"  - PostgreSQL Host: {POSTGRES_HOST}")
-            print(f"  - PostgreSQL Port: {POSTGRES_PORT}")
-            print(f"  - PostgreSQL Database: {POSTGRES_DB}")
-            print(f"  - Kafka Bootstrap Servers: {KAFKA_BOOTSTRAP_SERVERS}")
-            print("\nTroubleshooting Steps:")
-            print("  1. Verify JDBC driver: /opt/flink/lib/postgresql-*.jar exists")
-            print("  2. Check PostgreSQL connectivity: python3 socket test")
-            print("  3. Try manual SQL execution in SQL Client")
-            sys.stdout.flush()
+        job_ids = [row['fields'][0] for row in result.get('results', {}).get('data', [])]
+        log.info("=" * 60)
+        log.info("FLINK JOB SUBMITTED: %s", ', '.join(job_ids) or 'unknown job id')
+        log.info("=" * 60)
+        return True
         
-    except subprocess.TimeoutExpired:
-        print("Flink SQL job is running (timeout is expected for streaming jobs)")
-        sys.stdout.flush()
     except Exception as e:
-        print(f"Error submitting Flink job: {e}")
-        import traceback
-        traceback.print_exc()
-        sys.stdout.flush()
+        log.error("Error submitting Flink job: %s", e)
+        log.info("Diagnostic Information:")
+        log.info("  - SQL Gateway: %s", SQL_GATEWAY_URL)
+        log.info("  - PostgreSQL Host: %s", POSTGRES_HOST)
+        log.info("  - PostgreSQL Port: %s", POSTGRES_PORT)
+        log.info("  - PostgreSQL Database: %s", POSTGRES_DB)
+        log.info("  - Kafka Bootstrap Servers: %s", KAFKA_BOOTSTRAP_SERVERS)
+        log.info("Troubleshooting Steps:")
+        log.info("  1. Verify JDBC driver: /opt/flink/lib/postgresql-*.jar exists")
+        log.info("  2. Check the flink-sql-gateway container logs")
+        log.info("  3. Try manual SQL execution in SQL Client")
+        log.exception("Flink job submission traceback")
+        return False
+    finally:
+        # The submitted job outlives the session; close it rather than leave
+        # it on the gateway until the idle timeout
+        if session_handle:
+            try:
+                http_session.delete(f"{SQL_GATEWAY_URL}/v1/sessions/{session_handle}", timeout=GATEWAY_TIMEOUT)
+            except Exception as e:
+                log.warning("Could not close SQL Gateway session: %s", e)
 
-def create_flink_job_via_api():
+def create_flink_job_via_api(statements):
     """Alternative: Create and submit Flink job programmatically"""
-    print("\n" + "=" * 60)
-    print("FLINK JOB SETUP COMPLETE")
-    print("=" * 60)
-    print("\nTo manually submit the Flink job, you can:")
-    print("1. Access Flink Web UI at http://localhost:8081")
-    print("2. Use Flink SQL Client:")
-    print("   docker exec -it flink-jobmanager /opt/flink/bin/sql-client.sh")
-    print("\n3. Or use the following SQL statements:")
-    print("-" * 60)
+    log.info("=" * 60)
+    log.info("FLINK JOB SETUP COMPLETE")
+    log.info("=" * 60)
+    log.info("To manually submit the Flink job, you can:")
+    log.info("1. Access Flink Web UI at http://localhost:8081")
+    log.info("2. Use Flink SQL Client:")
+    log.info("   docker exec -it flink-jobmanager /opt/flink/bin/sql-client.sh")
+    log.info("3. Or use the following SQL statements:")
+    log.info("-" * 60)
     
-    sql = f"""
-CREATE TABLE kafka_orders (
-    `before` ROW<order_id INT, user_id INT, name STRING>,
-    `after` ROW<order_id INT, user_id INT, name STRING>,
-    `op` STRING,
-    `ts_ms` BIGINT
-) WITH (
-    'connector' = 'kafka',
-    'topic' = 'dbserver1.public.orders',
-    'properties.bootstrap.servers' = '{KAFKA_BOOTSTRAP_SERVERS}',
-    'properties.group.id' = 'flink-consumer-group',
-    'scan.startup.mode' = 'earliest-offset',
-    'format' = 'json',
-    'json.fail-on-missing-field' = 'false',
-    'json.ignore-parse-errors' = 'true'
-);
-
-CREATE TABLE orders_flink_sink (
-    order_id INT,
-    user_id INT,
-    PRIMARY KEY (order_id) NOT ENFORCED
-) WITH (
-    'connector' = 'jdbc',
-    'url' = 'jdbc:postgresql://{POSTGRES_HOST}:{POSTGRES_PORT}/{POSTGRES_DB}',
-    'table-name' = 'orders_flink',
-    'username' = '{POSTGRES_USER}',
-    'password' = '{POSTGRES_PASSWORD}',
-    'driver' = 'org.postgresql.Driver',
-    'connection.max-retry-timeout' = '300000',
-    'sink.max-retries' = '3',
-    'sink.buffer-flush.max-rows' = '100',
-    'sink.buffer-flush.interval' = '1000'
-);
-
-INSERT INTO orders_flink_sink
-SELECT 
-    COALESCE(`after`.order_id, `before`.order_id) as order_id,
-    COALESCE(`after`.user_id, `before`.user_id) as user_id
-FROM kafka_orders
-WHERE `op` IN ('c', 'r', 'u');
-"""
+    sql = render_sql(statements)
     
-    print(sql)
-    print("-" * 60)
+    log.info("%s", sql)
+    log.info("-" * 60)
     
-    # Save to file for user reference
-    with open('/tmp/flink_setup_instructions.sql', 'w') as f:
-        f.write(sql)
+    # Save to file for user reference, only rewriting it when the SQL changed
+    try:
+        with open(INSTRUCTIONS_FILE) as f:
+            unchanged = f.read() == sql
+    except OSError:
+        unchanged = False
+    if not unchanged:
+        write_atomic(INSTRUCTIONS_FILE, sql)
     
-    print("\nSQL statements saved to: /tmp/flink_setup_instructions.sql")
-    print("=" * 60)
-    sys.stdout.flush()
+    log.info("SQL statements saved to: %s", INSTRUCTIONS_FILE)
+    log.info("=" * 60)
 
 def main():
-    print("Starting Flink SQL Client initialization...")
-    sys.stdout.flush()
+    # As PID 1 the process needs an explicit SIGTERM handler or `docker stop`
+    # waits for the kill timeout; install it before the (long) service waits
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    
+    log.info("Starting Flink SQL Client initialization...")
     
     wait_for_services()
     
+    job_name, statements = build_sql_statements()
+    
     # Try to submit the job, but provide manual instructions as well
     try:
-        print("\n" + "=" * 60)
-        print("SUBMITTING FLINK SQL JOB")
-        print("=" * 60)
-        sys.stdout.flush()
-        submit_flink_sql_job()
+        # The cluster is the source of truth: a job named after this SQL's hash
+        # is kept, any other job under FLINK_JOB_NAME is replaced
+        active = active_flink_jobs()
+        if active is None:
+            log.warning("Cannot tell whether '%s' is already running, skipping submission", FLINK_JOB_NAME)
+        else:
+            current = [job_id for job_id, name in active if name == job_name]
+            stale = [job_id for job_id, name in active if name != job_name]
+            if stale and not all(cancel_flink_job(job_id) for job_id in stale):
+                log.warning("Could not cancel the outdated '%s' job, skipping submission", FLINK_JOB_NAME)
+            elif current:
+                log.info("Flink job '%s' is already running this SQL, skipping submission", job_name)
+            else:
+                log.info("=" * 60)
+                log.info("SUBMITTING FLINK SQL JOB")
+                log.info("=" * 60)
+                submit_flink_sql_job(statements)
     except Exception as e:
-        print(f"Automatic job submission failed: {e}")
-        import traceback
-        traceback.print_exc()
-        sys.stdout.flush()
+        log.exception("Automatic job submission failed: %s", e)
     
     # Always provide manual instructions
-    create_flink_job_via_api()
+    create_flink_job_via_api(statements)
     
     # Keep container running so user can access it
-    print("\nContainer will keep running for manual job submission...")
-    print("Press Ctrl+C to exit")
-    sys.stdout.flush()
+    log.info("Container will keep running for manual job submission...")
+    log.info("Press Ctrl+C to exit")
     
+    # Sleep until a signal arrives
     try:
-        while True:
-            time.sleep(60)
-    except KeyboardInterrupt:
-        print("\nShutting down...")
-        sys.stdout.flush()
+        signal.pause()
+    except (KeyboardInterrupt, SystemExit):
+        log.info("Shutting down...")
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
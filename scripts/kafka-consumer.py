@@ -1,9 +1,29 @@
-import json
+import logging
 import os
+import queue
+import random
+import sys
+import threading
 import time
+import orjson
 from kafka import KafkaConsumer
-import psycopg2
+from kafka.structs import OffsetAndMetadata
+from psycopg2 import InterfaceError, OperationalError
+from psycopg2.extensions import connection as PGConnection
 from psycopg2.extras import execute_values
+from psycopg2.pool import ThreadedConnectionPool
+
+# Configure logging once; records are line-buffered to stdout for Docker logs
+sys.stdout.reconfigure(line_buffering=True)
+logging.basicConfig(
+    level=logging.INFO,
+    format='[%(asctime)s] %(message)s',
+    datefmt='%Y-%m-%d %H:%M:%S',
+    stream=sys.stdout
+)
+log = logging.getLogger(__name__)
+# kafka-python is chatty at INFO
+logging.getLogger('kafka').setLevel(logging.WARNING)
 
 # Configuration from environment variables
 KAFKA_BOOTSTRAP_SERVERS = os.getenv('KAFKA_BOOTSTRAP_SERVERS', 'kafka:29092')
@@ -13,89 +33,213 @@ POSTGRES_PORT = os.getenv('POSTGRES_PORT', '5432')
 POSTGRES_USER = os.getenv('POSTGRES_USER', 'destuser')
 POSTGRES_PASSWORD = os.getenv('POSTGRES_PASSWORD', 'destpass')
 POSTGRES_DB = os.getenv('POSTGRES_DB', 'destdb')
+DB_POOL_MIN_CONN = int(os.getenv('DB_POOL_MIN_CONN', '2'))
+DB_POOL_MAX_CONN = int(os.getenv('DB_POOL_MAX_CONN', '8'))
+POLL_TIMEOUT_MS = int(os.getenv('POLL_TIMEOUT_MS', '500'))
+MAX_POLL_RECORDS = int(os.getenv('MAX_POLL_RECORDS', '2000'))
+# Fewer, larger fetches; keep the max wait modest so a quiet topic does not
+# stall the pipeline for the full broker default on restart
+FETCH_MIN_BYTES = int(os.getenv('FETCH_MIN_BYTES', str(64 * 1024)))
+FETCH_MAX_WAIT_MS = int(os.getenv('FETCH_MAX_WAIT_MS', '200'))
+MAX_PARTITION_FETCH_BYTES = int(os.getenv('MAX_PARTITION_FETCH_BYTES', str(4 * 1024 * 1024)))
+FETCH_MAX_BYTES = int(os.getenv('FETCH_MAX_BYTES', str(100 * 1024 * 1024)))
+# Batches handed to the DB writer thread ahead of the one being written
+PREFETCH_DEPTH = int(os.getenv('PREFETCH_DEPTH', '2'))
+# Pending rows after which partitions are paused while the DB writer is behind
+MAX_BUFFERED_ROWS = int(os.getenv('MAX_BUFFERED_ROWS', '10000'))
+PAGE_SIZE = 500
+
+UPSERT_SQL = """
+    INSERT INTO orders (order_id, user_id, name)
+    VALUES %s
+    ON CONFLICT (order_id) DO UPDATE
+    SET user_id = EXCLUDED.user_id,
+        name = EXCLUDED.name
+"""
+
+UPDATE_SQL = """
+    UPDATE orders
+    SET user_id = v.user_id, name = v.name
+    FROM (VALUES %s) AS v(order_id, user_id, name)
+    WHERE orders.order_id = v.order_id
+"""
+
+# The delete has a fixed shape (one array parameter) so it is prepared once per
+# connection. The upsert/update are left to execute_values: its pages are a
+# fixed PAGE_SIZE rows (only the last is shorter) and could be prepared too,
+# but one parse per 500-row page is already small next to the rows it writes.
+PREPARE_DELETE_SQL = "PREPARE del_orders(int[]) AS DELETE FROM orders WHERE order_id = ANY($1)"
+DELETE_SQL = "EXECUTE del_orders(%s::int[])"
+
 
+def deserialize_value(raw):
+    """Decode a CDC event; orjson parses the raw bytes without a utf-8 decode"""
+    if not raw or b'"op":' not in raw:
+        # Tombstones and non-change events are dropped before paying for a parse
+        return None
+    return orjson.loads(raw)
 
-def wait_for_services():
-    """Wait for Kafka and PostgreSQL to be ready"""
-    print("Waiting for services to be ready...")
-    time.sleep(20)
+def backoff(attempt, base=0.5, cap=30):
+    """Capped exponential backoff with jitter, in seconds"""
+    return min(cap, base * 2 ** attempt) * (0.5 + random.random())
 
-def get_db_connection():
-    """Create PostgreSQL connection"""
+class PreparedConnection(PGConnection):
+    """Connection that prepares the fixed-shape statements as soon as it opens"""
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        with self:
+            with self.cursor() as cursor:
+                cursor.execute(PREPARE_DELETE_SQL)
+
+def create_db_pool():
+    """Create a PostgreSQL connection pool"""
     max_retries = 10
     retry_count = 0
     
     while retry_count < max_retries:
         try:
-            conn = psycopg2.connect(
+            pool = ThreadedConnectionPool(
+                DB_POOL_MIN_CONN,
+                DB_POOL_MAX_CONN,
                 host=POSTGRES_HOST,
                 port=POSTGRES_PORT,
                 user=POSTGRES_USER,
                 password=POSTGRES_PASSWORD,
-                database=POSTGRES_DB
+                database=POSTGRES_DB,
+                connection_factory=PreparedConnection
             )
-            print("Connected to PostgreSQL destination database")
-            return conn
+            log.info("Connected to PostgreSQL destination database")
+            return pool
         except Exception as e:
             retry_count += 1
-            print(f"Failed to connect to PostgreSQL (attempt {retry_count}/{max_retries}): {e}")
-            time.sleep(5)
+            log.warning("Failed to connect to PostgreSQL (attempt %d/%d): %s", retry_count, max_retries, e)
+            time.sleep(backoff(retry_count))
     
     raise Exception("Could not connect to PostgreSQL after multiple attempts")
 
-def process_message(message, cursor):
-    value = message.value
-    if not value:
+# Per-op handlers fold a CDC event into the pending batch, keyed by order_id.
+# The three buckets are kept disjoint so they can be flushed in any order and
+# each row only appears once per statement.
+
+def apply_upsert(payload, upserts, updates, deletes):
+    after = payload.get('after')
+    if after:
+        order_id = after['order_id']
+        deletes.discard(order_id)
+        updates.pop(order_id, None)
+        upserts[order_id] = (order_id, after['user_id'], after['name'])
+
+def apply_update(payload, upserts, updates, deletes):
+    after = payload.get('after')
+    if after:
+        order_id = after['order_id']
+        row = (order_id, after['user_id'], after['name'])
+        if order_id in upserts:
+            upserts[order_id] = row
+        else:
+            updates[order_id] = row
+
+def apply_delete(payload, upserts, updates, deletes):
+    before = payload.get('before')
+    if before:
+        order_id = before['order_id']
+        upserts.pop(order_id, None)
+        updates.pop(order_id, None)
+        deletes.add(order_id)
+
+HANDLERS = {
+    'c': apply_upsert,
+    'r': apply_upsert,
+    'u': apply_update,
+    'd': apply_delete,
+}
+
+def process_message(message, upserts, updates, deletes, handlers=HANDLERS):
+    """Fold a CDC event into the pending batch"""
+    # Values arrive as raw bytes and are decoded here, at the batch boundary
+    payload = deserialize_value(message.value)
+    if not payload:
         return
 
-    payload = value   # ← critical fix
-    op = payload.get('op')
-
-    if op in ['c', 'r']:
-        after = payload.get('after')
-        if after:
-            cursor.execute("""
-                INSERT INTO orders (order_id, user_id, name)
-                VALUES (%s, %s, %s)
-                ON CONFLICT (order_id) DO UPDATE
-                SET user_id = EXCLUDED.user_id,
-                    name = EXCLUDED.name
-            """, (
-                after['order_id'],
-                after['user_id'],
-                after['name']
-            ))
-
-    elif op == 'u':
-        after = payload.get('after')
-        if after:
-            cursor.execute("""
-                UPDATE orders
-                SET user_id = %s, name = %s
-                WHERE order_id = %s
-            """, (
-                after['user_id'],
-                after['name'],
-                after['order_id']
-            ))
-
-    elif op == 'd':
-        before = payload.get('before')
-        if before:
-            cursor.execute(
-                "DELETE FROM orders WHERE order_id = %s",
-                (before['order_id'],)
-            )
+    handler = handlers.get(payload.get('op'))
+    if handler:
+        handler(payload, upserts, updates, deletes)
 
-    
+def flush_batch(pool, upserts, updates, deletes):
+    """Apply a batch of changes in a single transaction on a pooled connection"""
+    conn = pool.getconn()
+    try:
+        with conn:
+            with conn.cursor() as cursor:
+                if upserts:
+                    execute_values(cursor, UPSERT_SQL, list(upserts.values()), page_size=PAGE_SIZE)
+                if updates:
+                    execute_values(cursor, UPDATE_SQL, list(updates.values()), page_size=PAGE_SIZE)
+                if deletes:
+                    cursor.execute(DELETE_SQL, (list(deletes),))
+    finally:
+        # Broken connections are discarded here and reopened on the next getconn
+        pool.putconn(conn)
+
+def flush_rows(pool, upserts, updates, deletes):
+    """Re-apply a rejected batch one change per transaction, skipping bad rows"""
+    changes = (
+        [(order_id, ({order_id: row}, {}, set())) for order_id, row in upserts.items()]
+        + [(order_id, ({}, {order_id: row}, set())) for order_id, row in updates.items()]
+        + [(order_id, ({}, {}, {order_id})) for order_id in deletes]
+    )
+    for order_id, change in changes:
+        try:
+            flush_batch(pool, *change)
+        except (OperationalError, InterfaceError):
+            raise
+        except Exception as e:
+            log.error("Skipping change to order %s: %s", order_id, e)
+
+def db_writer(pool, pending, flushed):
+    """Flush handed-off batches in order, retrying while the database is unreachable"""
+    while True:
+        upserts, updates, deletes, offsets = pending.get()
+        failures = 0
+        row_by_row = False
+        while True:
+            try:
+                if row_by_row:
+                    flush_rows(pool, upserts, updates, deletes)
+                else:
+                    flush_batch(pool, upserts, updates, deletes)
+                break
+            except (OperationalError, InterfaceError) as e:
+                # Connection-level failures are retried; changes are idempotent
+                failures += 1
+                log.error("Database unavailable, will retry batch: %s", e)
+                time.sleep(backoff(failures))
+            except Exception as e:
+                # Data errors would fail forever, so isolate the rows at fault
+                log.error("Batch rejected, re-applying row by row: %s", e)
+                row_by_row = True
+        flushed.put(offsets)
+
+def commit_flushed(consumer, flushed):
+    """Commit Kafka offsets for every batch the writer has committed to the DB"""
+    offsets = {}
+    while True:
+        try:
+            offsets.update(flushed.get_nowait())
+        except queue.Empty:
+            break
+    if not offsets:
+        return
+    try:
+        consumer.commit({tp: OffsetAndMetadata(offset, '', -1) for tp, offset in offsets.items()})
+    except Exception as e:
+        # e.g. the partition was revoked; the new owner resumes from the last commit
+        log.error("Error committing offsets: %s", e)
 
 def main():
     """Main consumer loop"""
-    wait_for_services()
-    
     # Connect to PostgreSQL
-    conn = get_db_connection()
-    conn.autocommit = True
+    pool = create_db_pool()
     
     # Create Kafka consumer
     max_retries = 10
@@ -108,39 +252,81 @@ def main():
                 KAFKA_TOPIC,
                 bootstrap_servers=KAFKA_BOOTSTRAP_SERVERS,
                 auto_offset_reset='earliest',
-                enable_auto_commit=True,
+                enable_auto_commit=False,
                 group_id='postgres-consumer-group',
-                value_deserializer=lambda x: json.loads(x.decode('utf-8')) if x else None
+                fetch_min_bytes=FETCH_MIN_BYTES,
+                fetch_max_wait_ms=FETCH_MAX_WAIT_MS,
+                max_partition_fetch_bytes=MAX_PARTITION_FETCH_BYTES,
+                fetch_max_bytes=FETCH_MAX_BYTES,
+                max_poll_records=MAX_POLL_RECORDS
             )
-            print(f"Connected to Kafka and subscribed to topic: {KAFKA_TOPIC}")
+            log.info("Connected to Kafka and subscribed to topic: %s", KAFKA_TOPIC)
             break
         except Exception as e:
             retry_count += 1
-            print(f"Failed to connect to Kafka (attempt {retry_count}/{max_retries}): {e}")
-            time.sleep(5)
+            log.warning("Failed to connect to Kafka (attempt %d/%d): %s", retry_count, max_retries, e)
+            time.sleep(backoff(retry_count))
     
     if not consumer:
         raise Exception("Could not connect to Kafka after multiple attempts")
     
-    print("Starting to consume messages...")
+    log.info("Starting to consume messages...")
+    
+    # Polling and folding happen on this thread while a writer thread flushes
+    # earlier batches, so the next fetch overlaps the current DB write. Kafka
+    # offsets are committed here (the consumer is not thread-safe) once the
+    # writer reports the batch committed to the DB.
+    pending = queue.Queue(maxsize=PREFETCH_DEPTH)
+    flushed = queue.Queue()
+    threading.Thread(target=db_writer, args=(pool, pending, flushed), daemon=True).start()
+    
+    # Changes folded from polled messages but not yet handed to the writer;
+    # once they reach MAX_BUFFERED_ROWS the partitions are paused until the
+    # writer catches up.
+    upserts, updates, deletes, offsets = {}, {}, set(), {}
+    paused = False
     
     try:
-        for message in consumer:
+        while True:
+            # Paused partitions return nothing, but polling keeps the consumer in the group
+            batches = consumer.poll(timeout_ms=POLL_TIMEOUT_MS, max_records=MAX_POLL_RECORDS)
+            for tp, records in batches.items():
+                offsets[tp] = records[-1].offset + 1
+                for message in records:
+                    try:
+                        process_message(message, upserts, updates, deletes)
+                    except Exception as e:
+                        log.error("Error processing message at offset %d: %s", message.offset, e)
+
+            commit_flushed(consumer, flushed)
+
+            if not offsets:
+                continue
+
             try:
-                cursor = conn.cursor()
-                process_message(message, cursor)
-                cursor.close()
-            except Exception as e:
-                print(f"Error processing message: {e}")
-                conn.rollback()
+                pending.put_nowait((upserts, updates, deletes, offsets))
+            except queue.Full:
+                buffered = len(upserts) + len(updates) + len(deletes)
+                if not paused and buffered >= MAX_BUFFERED_ROWS:
+                    consumer.pause(*consumer.assignment())
+                    paused = True
+                    log.warning("Paused consumption with %d rows buffered", buffered)
+                continue
+            
+            upserts, updates, deletes, offsets = {}, {}, set(), {}
+            
+            if paused:
+                consumer.resume(*consumer.assignment())
+                paused = False
+                log.info("Resumed consumption")
     
     except KeyboardInterrupt:
-        print("Shutting down consumer...")
+        log.info("Shutting down consumer...")
     finally:
         if consumer:
             consumer.close()
-        if conn:
-            conn.close()
+        if pool:
+            pool.closeall()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
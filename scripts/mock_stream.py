@@ -1,8 +1,22 @@
+import io
+import logging
+import sys
+import numpy as np
 import psycopg2
+from psycopg2.extras import execute_values
 import time
 import random
 import os
-from datetime import datetime
+
+# Configure logging once; records are line-buffered to stdout for Docker logs
+sys.stdout.reconfigure(line_buffering=True)
+logging.basicConfig(
+    level=logging.INFO,
+    format='[%(asctime)s] %(message)s',
+    datefmt='%Y-%m-%d %H:%M:%S',
+    stream=sys.stdout
+)
+log = logging.getLogger(__name__)
 
 # Configuration from environment variables
 POSTGRES_HOST = os.getenv('POSTGRES_HOST', 'postgres-source')
@@ -11,6 +25,28 @@ POSTGRES_USER = os.getenv('POSTGRES_USER', 'sourceuser')
 POSTGRES_PASSWORD = os.getenv('POSTGRES_PASSWORD', 'sourcepass')
 POSTGRES_DB = os.getenv('POSTGRES_DB', 'sourcedb')
 INTERVAL_SECONDS = int(os.getenv('INTERVAL_SECONDS', '10'))
+# Rows written per tick; above 1 each tick applies a whole burst of one operation
+BURST_SIZE = int(os.getenv('BURST_SIZE', '1'))
+
+PREPARED_STATEMENTS = (
+    "PREPARE ins_order(int, text) AS "
+    "INSERT INTO orders (user_id, name) VALUES ($1, $2) RETURNING order_id",
+    "PREPARE upd_order(int, text, int) AS "
+    "UPDATE orders SET user_id = $1, name = $2 WHERE order_id = $3",
+    "PREPARE del_order(int) AS "
+    "DELETE FROM orders WHERE order_id = $1",
+)
+
+# Random row sampling: a keyset probe into a cached [min, max] order_id range.
+# TABLESAMPLE SYSTEM_ROWS is not used: it reads tuples in page order, so on a
+# small table it returns the same oldest rows every time.
+ID_RANGE_REFRESH_TICKS = 100
+id_range = (None, None)
+id_range_age = ID_RANGE_REFRESH_TICKS
+
+# Rows in orders, seeded once with COUNT(*) and kept in step with our own DML.
+# Writes made by other clients are not reflected until the generator restarts.
+order_count = 0
 
 # Sample data for generating synthetic records
 FIRST_NAMES = [
@@ -31,9 +67,34 @@ LAST_NAMES = [
     'Green', 'Adams', 'Nelson', 'Baker', 'Hall', 'Rivera', 'Campbell', 'Mitchell'
 ]
 
+# Every "First Last" combination, built once so a tick is a single index lookup
+NAMES = tuple(f"{first} {last}" for first in FIRST_NAMES for last in LAST_NAMES)
+# Same pool as fixed-width bytes so bursts can be assembled without Python loops
+NAME_BYTES = np.array([name.encode() for name in NAMES], dtype='S32')
+
+# Random sources: one pinned stdlib generator for single values on the per-row
+# path, and a NumPy generator for anything drawn in bulk
+rand = random.Random()
+RNG = np.random.default_rng()
+
+OPERATIONS = np.array(['insert', 'update', 'delete'])
+OPERATION_WEIGHTS = [0.7, 0.2, 0.1]
+OPERATION_BLOCK = 1024
+
+def operation_stream():
+    """Endless stream of operations, drawn 70/20/10 a block at a time"""
+    while True:
+        yield from RNG.choice(OPERATIONS, p=OPERATION_WEIGHTS, size=OPERATION_BLOCK).tolist()
+
+operations = operation_stream()
+
+def backoff(attempt, base=0.5, cap=30):
+    """Capped exponential backoff with jitter, in seconds"""
+    return min(cap, base * 2 ** attempt) * (0.5 + rand.random())
+
 def wait_for_database():
     """Wait for PostgreSQL to be ready"""
-    print("Waiting for PostgreSQL source database to be ready...")
+    log.info("Waiting for PostgreSQL source database to be ready...")
     max_retries = 30
     retry_count = 0
     
@@ -47,33 +108,70 @@ def wait_for_database():
                 database=POSTGRES_DB
             )
             conn.close()
-            print("✓ PostgreSQL is ready!")
+            log.info("✓ PostgreSQL is ready!")
             return True
         except Exception as e:
             retry_count += 1
-            print(f"Waiting for database (attempt {retry_count}/{max_retries})...")
-            time.sleep(5)
+            log.info("Waiting for database (attempt %d/%d)...", retry_count, max_retries)
+            time.sleep(backoff(retry_count))
     
     raise Exception("Could not connect to PostgreSQL after multiple attempts")
 
 def get_db_connection():
-    """Create PostgreSQL connection"""
-    return psycopg2.connect(
+    """Create PostgreSQL connection with the DML statements prepared"""
+    conn = psycopg2.connect(
         host=POSTGRES_HOST,
         port=POSTGRES_PORT,
         user=POSTGRES_USER,
         password=POSTGRES_PASSWORD,
         database=POSTGRES_DB
     )
+    # Prepared statements live for the whole session, so the server parses
+    # and plans them once instead of on every tick
+    cursor = conn.cursor()
+    for statement in PREPARED_STATEMENTS:
+        cursor.execute(statement)
+    cursor.close()
+    conn.commit()
+    return conn
+
+def pick_random_order_ids(cursor, n):
+    """Pick up to n distinct random order_ids without sorting the whole table"""
+    global id_range, id_range_age
+
+    if id_range_age >= ID_RANGE_REFRESH_TICKS or id_range[0] is None:
+        cursor.execute("SELECT min(order_id), max(order_id) FROM orders")
+        id_range = cursor.fetchone()
+        id_range_age = 0
+    id_range_age += 1
+
+    lo, hi = id_range
+    if lo is None:
+        return []
+
+    # One index probe per random point; fall back to the nearest lower id when
+    # rows at the top of the cached range have been deleted since
+    probes = RNG.integers(lo, hi, size=n, endpoint=True).tolist()
+    cursor.execute("""
+        SELECT DISTINCT COALESCE(
+            (SELECT order_id FROM orders WHERE order_id >= r ORDER BY order_id LIMIT 1),
+            (SELECT order_id FROM orders WHERE order_id < r ORDER BY order_id DESC LIMIT 1)
+        )
+        FROM unnest(%s::int[]) AS r
+    """, (probes,))
+    return [row[0] for row in cursor.fetchall() if row[0] is not None]
+
+def pick_random_order_id(cursor):
+    """Pick a random existing order_id, or None if the table is empty"""
+    order_ids = pick_random_order_ids(cursor, 1)
+    return order_ids[0] if order_ids else None
 
 def generate_synthetic_order():
     """Generate a synthetic order with random data"""
-    first_name = random.choice(FIRST_NAMES)
-    last_name = random.choice(LAST_NAMES)
-    full_name = f"{first_name} {last_name}"
+    full_name = NAMES[rand.randrange(len(NAMES))]
     
     # Generate user_id between 1 and 10000
-    user_id = random.randint(1, 10000)
+    user_id = rand.randint(1, 10000)
     
     return {
         'user_id': user_id,
@@ -82,79 +180,126 @@ def generate_synthetic_order():
 
 def insert_order(cursor, order):
     """Insert a new order into the database"""
+    global order_count
     cursor.execute(
-        "INSERT INTO orders (user_id, name) VALUES (%s, %s) RETURNING order_id",
+        "EXECUTE ins_order(%s, %s)",
         (order['user_id'], order['name'])
     )
     order_id = cursor.fetchone()[0]
+    order_count += 1
     return order_id
 
+def generate_order_batch(n):
+    """Generate n synthetic orders as (user_ids, name indexes) arrays"""
+    user_ids = RNG.integers(1, 10001, size=n, dtype=np.int32)
+    name_idx = RNG.integers(0, len(NAMES), size=n)
+    return user_ids, name_idx
+
+def copy_order_batch(cursor, user_ids, name_idx):
+    """Bulk-insert a generated batch with COPY FROM STDIN"""
+    global order_count
+    lines = np.char.add(np.char.add(user_ids.astype('S5'), b'\t'), NAME_BYTES[name_idx])
+    buf = io.BytesIO(b'\n'.join(lines) + b'\n')
+    cursor.copy_from(buf, 'orders', columns=('user_id', 'name'))
+    order_count += len(user_ids)
+
+def perform_burst(cursor, operation):
+    """Apply BURST_SIZE rows of a single operation class in one statement"""
+    global order_count
+    if operation != 'insert':
+        order_ids = pick_random_order_ids(cursor, BURST_SIZE)
+        if not order_ids:
+            # If no orders exist, insert instead
+            operation = 'insert'
+    
+    if operation == 'insert':
+        copy_order_batch(cursor, *generate_order_batch(BURST_SIZE))
+        log.info("✓ INSERTED %d orders", BURST_SIZE)
+    
+    elif operation == 'update':
+        user_ids, name_idx = generate_order_batch(len(order_ids))
+        rows = list(zip(order_ids, user_ids.tolist(), (NAMES[i] for i in name_idx)))
+        execute_values(cursor, """
+            UPDATE orders
+            SET user_id = v.user_id, name = v.name
+            FROM (VALUES %s) AS v(order_id, user_id, name)
+            WHERE orders.order_id = v.order_id
+        """, rows, page_size=len(rows))
+        log.info("✓ UPDATED %d orders", len(rows))
+    
+    elif operation == 'delete':
+        cursor.execute("DELETE FROM orders WHERE order_id = ANY(%s)", (order_ids,))
+        order_count -= cursor.rowcount
+        log.info("✓ DELETED %d orders", cursor.rowcount)
+
 def perform_random_operation(cursor):
     """
     Randomly decide whether to INSERT, UPDATE, or DELETE
     70% INSERT, 20% UPDATE, 10% DELETE
     """
-    operation = random.choices(
-        ['insert', 'update', 'delete'],
-        weights=[70, 20, 10],
-        k=1
-    )[0]
+    global order_count
+    operation = next(operations)
+    
+    if BURST_SIZE > 1:
+        perform_burst(cursor, operation)
+        return
     
     if operation == 'insert':
         order = generate_synthetic_order()
         order_id = insert_order(cursor, order)
-        print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] ✓ INSERTED order_id={order_id}, user_id={order['user_id']}, name='{order['name']}'")
+        log.info("✓ INSERTED order_id=%s, user_id=%s, name='%s'", order_id, order['user_id'], order['name'])
     
     elif operation == 'update':
         # Get a random existing order
-        cursor.execute("SELECT order_id FROM orders ORDER BY RANDOM() LIMIT 1")
-        result = cursor.fetchone()
+        order_id = pick_random_order_id(cursor)
         
-        if result:
-            order_id = result[0]
+        if order_id is not None:
             order = generate_synthetic_order()
             cursor.execute(
-                "UPDATE orders SET user_id = %s, name = %s WHERE order_id = %s",
+                "EXECUTE upd_order(%s, %s, %s)",
                 (order['user_id'], order['name'], order_id)
             )
-            print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] ✓ UPDATED order_id={order_id}, user_id={order['user_id']}, name='{order['name']}'")
+            log.info("✓ UPDATED order_id=%s, user_id=%s, name='%s'", order_id, order['user_id'], order['name'])
         else:
             # If no orders exist, insert one instead
             order = generate_synthetic_order()
             order_id = insert_order(cursor, order)
-            print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] ✓ INSERTED order_id={order_id} (no orders to update)")
+            log.info("✓ INSERTED order_id=%s (no orders to update)", order_id)
     
     elif operation == 'delete':
         # Get a random existing order
-        cursor.execute("SELECT order_id FROM orders ORDER BY RANDOM() LIMIT 1")
-        result = cursor.fetchone()
+        order_id = pick_random_order_id(cursor)
         
-        if result:
-            order_id = result[0]
-            cursor.execute("DELETE FROM orders WHERE order_id = %s", (order_id,))
-            print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] ✓ DELETED order_id={order_id}")
+        if order_id is not None:
+            cursor.execute("EXECUTE del_order(%s)", (order_id,))
+            order_count -= cursor.rowcount
+            log.info("✓ DELETED order_id=%s", order_id)
         else:
             # If no orders exist, insert one instead
             order = generate_synthetic_order()
             order_id = insert_order(cursor, order)
-            print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] ✓ INSERTED order_id={order_id} (no orders to delete)")
+            log.info("✓ INSERTED order_id=%s (no orders to delete)", order_id)
 
-def get_statistics(cursor):
-    """Get current database statistics"""
+def seed_order_count(cursor):
+    """Initialise the in-process order counter with a single COUNT(*)"""
+    global order_count
     cursor.execute("SELECT COUNT(*) FROM orders")
-    count = cursor.fetchone()[0]
-    return count
+    order_count = cursor.fetchone()[0]
+
+def get_statistics():
+    """Get current database statistics"""
+    return order_count
 
 def main():
     """Main loop to generate synthetic data"""
-    print("=" * 60)
-    print("Synthetic Data Generator")
-    print("=" * 60)
-    print(f"Target: {POSTGRES_HOST}:{POSTGRES_PORT}/{POSTGRES_DB}")
-    print(f"Interval: {INTERVAL_SECONDS} seconds")
-    print(f"Operations: 70% INSERT, 20% UPDATE, 10% DELETE")
-    print("=" * 60)
-    print()
+    log.info("=" * 60)
+    log.info("Synthetic Data Generator")
+    log.info("=" * 60)
+    log.info("Target: %s:%s/%s", POSTGRES_HOST, POSTGRES_PORT, POSTGRES_DB)
+    log.info("Interval: %s seconds", INTERVAL_SECONDS)
+    log.info("Burst size: %s rows per operation", BURST_SIZE)
+    log.info("Operations: 70% INSERT, 20% UPDATE, 10% DELETE")
+    log.info("=" * 60)
     
     # Wait for database to be ready
     wait_for_database()
@@ -163,15 +308,17 @@ def main():
     conn = get_db_connection()
     conn.autocommit = True
     
-    print("Starting data generation...")
-    print()
+    # One cursor for the whole run; recreated only after errors
+    cursor = conn.cursor()
+    seed_order_count(cursor)
+    
+    log.info("Starting data generation...")
     
     counter = 0
     
     try:
         while True:
             counter += 1
-            cursor = conn.cursor()
             
             try:
                 # Perform random operation
@@ -179,23 +326,21 @@ def main():
                 
                 # Every 10 operations, show statistics
                 if counter % 10 == 0:
-                    total_orders = get_statistics(cursor)
-                    print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] --- Total orders in database: {total_orders} ---")
-                    print()
-                
-                cursor.close()
+                    total_orders = get_statistics()
+                    log.info("--- Total orders in database: %d ---", total_orders)
                 
             except Exception as e:
-                print(f"Error in operation: {e}")
+                log.error("Error in operation: %s", e)
                 cursor.close()
+                cursor = conn.cursor()
             
             # Wait for next iteration
             time.sleep(INTERVAL_SECONDS)
     
     except KeyboardInterrupt:
-        print("\n" + "=" * 60)
-        print("Shutting down data generator...")
-        print("=" * 60)
+        log.info("=" * 60)
+        log.info("Shutting down data generator...")
+        log.info("=" * 60)
     
     finally:
         if conn: